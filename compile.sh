@@ -30,8 +30,12 @@ function compile() {
     MP_FILE_PATH="${FILE_PATH%.*}.mpy"
 
     #mpy-cross -mno-unicode -o "$out_path" -s "$mp_path" "$FILE_PATH"
-    #mpy-cross -march=xtensa -X emit=native "$FILE_PATH" &>/dev/null || mpy-cross -march=xtensa "$FILE_PATH"
-    mpy-cross "$FILE_PATH"
+    # Try the native emitter first, so the packet framing and receive loops run
+    # as machine code. Fall back to portable bytecode when the target does not
+    # support it. Override the architecture with e.g. MPY_MARCH=armv7m.
+    # -O2 compiles out the assert statements, which only guard against API
+    # misuse; checks needed for correct packet framing are explicit raises.
+    mpy-cross -O2 -march=${MPY_MARCH:-xtensa} -X emit=native "$FILE_PATH" &>/dev/null || mpy-cross -O2 "$FILE_PATH"
     mv "$MP_FILE_PATH" "$out_dir"
 }
 
@@ -1,5 +1,6 @@
 import usocket as socket
 import uselect
+import ustruct as struct
 from utime import ticks_add, ticks_ms, ticks_diff
 
 
@@ -7,13 +8,21 @@ class MQTTException(Exception):
     pass
 
 
-def pid_gen(pid=0):
-    while True:
-        pid = pid + 1 if pid < 65535 else 1
-        yield pid
-
-
 class MQTTClient:
+    # Fixed attribute set: avoids the per-instance attribute dict and speeds up
+    # attribute access on ports that honour __slots__ (ignored on MicroPython).
+    # Subclasses without their own __slots__ still get a dict as usual.
+    __slots__ = ('client_id', 'sock', 'poller_r', 'poller_w', 'server', 'port',
+                 'ssl', 'ssl_params', '_pid', 'cb', 'cbstat', 'user', 'pswd',
+                 'keepalive', 'lw_topic', 'lw_msg', 'lw_qos', 'lw_retain',
+                 'rcv_pids', 'rcv_deadlines', '_tx_buf', '_rx_buf', '_connect_pkt', '_connect_clean',
+                 'last_ping', 'last_cpacket', 'socket_timeout', 'message_timeout')
+
+    # Initial sizes of the shared transmit and receive buffers. They are grown
+    # on demand when a packet does not fit, so these only need to cover the
+    # common case.
+    TX_BUF_SIZE = 256
+    RX_BUF_SIZE = 256
 
     def __init__(self, client_id, server, port=0, user=None, password=None, keepalive=0,
                  ssl=False, ssl_params=None, socket_timeout=5, message_timeout=10):
@@ -54,7 +63,7 @@ class MQTTClient:
         self.port = port
         self.ssl = ssl
         self.ssl_params = ssl_params if ssl_params else {}
-        self.newpid = pid_gen()
+        self._pid = 0  # last used packet ID, wraps to 1 after 65535
         if not getattr(self, 'cb', None):
             self.cb = None
         if not getattr(self, 'cbstat', None):
@@ -66,7 +75,16 @@ class MQTTClient:
         self.lw_msg = None
         self.lw_qos = 0
         self.lw_retain = False
-        self.rcv_pids = {}  # PUBACK and SUBACK pids awaiting ACK response
+        # Pids awaiting PUBACK/SUBACK and their deadlines, as parallel lists
+        # (no tuple per entry), oldest deadline first. Every entry gets the
+        # same message_timeout, so append order is deadline order and the
+        # timeout sweep only has to look at the head.
+        self.rcv_pids = []
+        self.rcv_deadlines = []
+        self._tx_buf = bytearray(self.TX_BUF_SIZE)  # scratch buffer for outgoing packets
+        self._rx_buf = bytearray(self.RX_BUF_SIZE)  # scratch buffer for incoming packets
+        self._connect_pkt = None  # cached CONNECT packet, see connect()
+        self._connect_clean = None  # clean_session flag the cache was built for
 
         self.last_ping = ticks_ms()  # Time of the last PING sent
         self.last_cpacket = ticks_ms()  # Time of last Control Packet
@@ -83,18 +101,30 @@ class MQTTClient:
         :return:
         """
         # in non-blocking mode, may not download enough data
+        if not self.sock:
+            raise MQTTException(28)
+        buf = self._rx_buf
+        if len(buf) < n:
+            buf = self._rx_buf = bytearray(n)
+        mv = memoryview(buf)
         try:
-            msg = b''
-            for i in range(n):
-                self._sock_timeout(self.poller_r, self.socket_timeout)
-                msg += self.sock.read(1)
+            # Cache bound methods and the timeout outside the loop; attribute
+            # lookups per chunk dominate the cost of short reads on MicroPython.
+            poll = self.poller_r.poll
+            readinto = self.sock.readinto
+            timeout = -1 if self.socket_timeout is None else int(self.socket_timeout * 1000)
+            pos = 0
+            while pos < n:
+                if not poll(timeout):
+                    raise MQTTException(30)
+                out = readinto(mv[pos:n])
+                if not out:
+                    # Connection closed by host (?)
+                    raise MQTTException(1 if pos == 0 else 2)
+                pos += out
         except AttributeError:
             raise MQTTException(8)
-        if msg == b'':  # Connection closed by host (?)
-            raise MQTTException(1)
-        if len(msg) != n:
-            raise MQTTException(2)
-        return msg
+        return bytes(mv[:n])
 
     def _write(self, bytes_wr, length=-1):
         """
@@ -120,16 +150,55 @@ class MQTTClient:
                 raise MQTTException(3)
         return out
 
-    def _send_str(self, s):
+    def _pack_str(self, buf, offset, s):
         """
         Private class method.
+        Packs a length-prefixed string into a buffer.
+
+        :param buf: Target buffer
+        :type buf: bytearray
+        :param offset: Offset in the buffer to write at
+        :type offset: int
         :param s:
         :type s: byte
-        :return: None
+        :return: Offset just past the packed string
+        :rtype: int
+        """
+        if len(s) > 65535:
+            # Explicit check: ustruct.pack_into would silently truncate the
+            # length prefix and corrupt the packet framing.
+            raise MQTTException(4)
+        struct.pack_into('>H', buf, offset, len(s))
+        offset += 2
+        buf[offset:offset + len(s)] = s
+        return offset + len(s)
+
+    def _tx_pkt(self, size):
         """
-        assert len(s) < 65536
-        self._write(len(s).to_bytes(2, 'big'))
-        self._write(s)
+        Private class method.
+        Returns the shared transmit buffer, grown if the packet does not fit.
+        Reusing one buffer avoids a heap allocation per sent packet.
+
+        :param size: Required packet size in bytes
+        :type size: int
+        :return: Scratch buffer of at least `size` bytes
+        :rtype: bytearray
+        """
+        buf = self._tx_buf
+        if len(buf) < size:
+            buf = self._tx_buf = bytearray(size)
+        return buf
+
+    def _next_pid(self):
+        """
+        Private class method.
+        Returns the next packet ID in the range 1..65535.
+
+        :rtype: int
+        """
+        pid = self._pid + 1 if self._pid < 65535 else 1
+        self._pid = pid
+        return pid
 
     def _recv_len(self):
         """
@@ -147,13 +216,26 @@ class MQTTClient:
             sh += 7
 
     def _varlen_encode(self, value, buf, offset=0):
+        # Branches instead of a shift loop: nearly all MQTT packets need one
+        # or two length bytes, so the common cases return right away.
+        if value < 0x80:
+            buf[offset] = value
+            return offset + 1
+        if value < 0x4000:
+            buf[offset] = value & 0x7f | 0x80
+            buf[offset + 1] = value >> 7
+            return offset + 2
+        if value < 0x200000:
+            buf[offset] = value & 0x7f | 0x80
+            buf[offset + 1] = value >> 7 & 0x7f | 0x80
+            buf[offset + 2] = value >> 14
+            return offset + 3
         assert value < 268435456  # 2**28, i.e. max. four 7-bit bytes
-        while value > 0x7f:
-            buf[offset] = (value & 0x7f) | 0x80
-            value >>= 7
-            offset += 1
-        buf[offset] = value
-        return offset + 1
+        buf[offset] = value & 0x7f | 0x80
+        buf[offset + 1] = value >> 7 & 0x7f | 0x80
+        buf[offset + 2] = value >> 14 & 0x7f | 0x80
+        buf[offset + 3] = value >> 21
+        return offset + 4
 
     def _sock_timeout(self, poller, socket_timeout):
         if self.sock:
@@ -208,6 +290,7 @@ class MQTTClient:
         self.lw_msg = msg
         self.lw_qos = qos
         self.lw_retain = retain
+        self._connect_pkt = None  # last will is part of the CONNECT packet
 
     def connect(self, clean_session=True):
         """
@@ -218,9 +301,20 @@ class MQTTClient:
         :return: Existing persistent session of the client from previous interactions.
         :rtype: bool
         """
+        clean_session = bool(clean_session)
+        # Clean session = True, remove current session
+        if clean_session:
+            self.rcv_pids = []
+            self.rcv_deadlines = []
         self.sock = socket.socket()
         addr = socket.getaddrinfo(self.server, self.port)[0][-1]
         self.sock.connect(addr)
+        try:
+            # Disable Nagle's algorithm. The MQTT control packets are small and latency-bound,
+            # so coalescing them in the TCP stack only delays the server's response.
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (OSError, AttributeError):
+            pass  # not supported on this port
         if self.ssl:
             import ussl
             self.sock = ussl.wrap_socket(self.sock, **self.ssl_params)
@@ -230,62 +324,67 @@ class MQTTClient:
         self.poller_w = uselect.poll()
         self.poller_w.register(self.sock, uselect.POLLOUT)
 
-        # Byte nr - desc
-        # 1 - \x10 0001 - Connect Command, 0000 - Reserved
-        # 2 - Remaining Length
-        # PROTOCOL NAME (3.1.2.1 Protocol Name)
-        # 3,4 - protocol name length len('MQTT')
-        # 5-8 = 'MQTT'
-        # PROTOCOL LEVEL (3.1.2.2 Protocol Level)
-        # 9 - mqtt version 0x04
-        # CONNECT FLAGS
-        # 10 - connection flags
-        #  X... .... = User Name Flag
-        #  .X.. .... = Password Flag
-        #  ..X. .... = Will Retain
-        #  ...X X... = QoS Level
-        #  .... .X.. = Will Flag
-        #  .... ..X. = Clean Session Flag
-        #  .... ...0 = (Reserved) It must be 0!
-        # KEEP ALIVE
-        # 11,12 - keepalive
-        # 13,14 - client ID length
-        # 15-15+len(client_id) - byte(client_id)
-        premsg = bytearray(b"\x10\0\0\0\0\0")
-        msg = bytearray(b"\0\x04MQTT\x04\0\0\0")
-
-        sz = 10 + 2 + len(self.client_id)
-
-        msg[7] = bool(clean_session) << 1
-        # Clean session = True, remove current session
-        if bool(clean_session):
-            self.rcv_pids.clear()
-        if self.user is not None:
-            sz += 2 + len(self.user)
-            msg[7] |= 1 << 7  # User Name Flag
-            if self.pswd is not None:
-                sz += 2 + len(self.pswd)
-                msg[7] |= 1 << 6  # # Password Flag
-        if self.keepalive:
-            assert self.keepalive < 65536
-            msg[8] |= self.keepalive >> 8
-            msg[9] |= self.keepalive & 0x00FF
-        if self.lw_topic:
-            sz += 2 + len(self.lw_topic) + 2 + len(self.lw_msg)
-            msg[7] |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
-            msg[7] |= self.lw_retain << 5
-
-        plen = self._varlen_encode(sz, premsg, 1)
-        self._write(premsg, plen)
-        self._write(msg)
-        self._send_str(self.client_id)
-        if self.lw_topic:
-            self._send_str(self.lw_topic)
-            self._send_str(self.lw_msg)
-        if self.user is not None:
-            self._send_str(self.user)
-            if self.pswd is not None:
-                self._send_str(self.pswd)
+        # The CONNECT packet only depends on constructor parameters, the last
+        # will and clean_session, so frequent reconnects (e.g. umqtt.robust2)
+        # reuse the cached copy instead of rebuilding it.
+        if self._connect_pkt is None or self._connect_clean != clean_session:
+            # Byte nr - desc
+            # 1 - \x10 0001 - Connect Command, 0000 - Reserved
+            # 2 - Remaining Length
+            # PROTOCOL NAME (3.1.2.1 Protocol Name)
+            # 3,4 - protocol name length len('MQTT')
+            # 5-8 = 'MQTT'
+            # PROTOCOL LEVEL (3.1.2.2 Protocol Level)
+            # 9 - mqtt version 0x04
+            # CONNECT FLAGS
+            # 10 - connection flags
+            #  X... .... = User Name Flag
+            #  .X.. .... = Password Flag
+            #  ..X. .... = Will Retain
+            #  ...X X... = QoS Level
+            #  .... .X.. = Will Flag
+            #  .... ..X. = Clean Session Flag
+            #  .... ...0 = (Reserved) It must be 0!
+            # KEEP ALIVE
+            # 11,12 - keepalive
+            # 13,14 - client ID length
+            # 15-15+len(client_id) - byte(client_id)
+            msg = bytearray(b"\0\x04MQTT\x04\0\0\0")
+
+            sz = 10 + 2 + len(self.client_id)
+
+            msg[7] = clean_session << 1
+            if self.user is not None:
+                sz += 2 + len(self.user)
+                msg[7] |= 1 << 7  # User Name Flag
+                if self.pswd is not None:
+                    sz += 2 + len(self.pswd)
+                    msg[7] |= 1 << 6  # # Password Flag
+            if self.keepalive:
+                assert self.keepalive < 65536
+                msg[8] = self.keepalive >> 8
+                msg[9] = self.keepalive & 0x00FF
+            if self.lw_topic:
+                sz += 2 + len(self.lw_topic) + 2 + len(self.lw_msg)
+                msg[7] |= 0x4 | self.lw_qos << 3 | self.lw_retain << 5
+
+            # Whole CONNECT packet in one buffer, so one socket write sends one TCP segment.
+            pkt = self._tx_pkt(5 + sz)
+            pkt[0] = 0x10
+            plen = self._varlen_encode(sz, pkt, 1)
+            pkt[plen:plen + 10] = msg
+            plen += 10
+            plen = self._pack_str(pkt, plen, self.client_id)
+            if self.lw_topic:
+                plen = self._pack_str(pkt, plen, self.lw_topic)
+                plen = self._pack_str(pkt, plen, self.lw_msg)
+            if self.user is not None:
+                plen = self._pack_str(pkt, plen, self.user)
+                if self.pswd is not None:
+                    plen = self._pack_str(pkt, plen, self.pswd)
+            self._connect_pkt = bytes(pkt[:plen])
+            self._connect_clean = clean_session
+        self._write(self._connect_pkt)
         resp = self._read(4)
         if not (resp[0] == 0x20 and resp[1] == 0x02):  # control packet type, Remaining Length == 2
             raise MQTTException(29)
@@ -335,22 +434,88 @@ class MQTTClient:
         :return: None
         """
         assert qos in (0, 1)
-        pkt = bytearray(b"\x30\0\0\0\0")
-        pkt[0] |= qos << 1 | retain | int(dup) << 3
         sz = 2 + len(topic) + len(msg)
         if qos > 0:
             sz += 2
+        # Small packets go out as one buffer and one socket write. Payloads
+        # that do not fit the scratch buffer are handed to the socket as-is
+        # after the header, so they are never copied and the shared buffer
+        # never has to grow for a big message.
+        copy_msg = 5 + sz <= len(self._tx_buf)
+        # worst-case header: fixed byte + 4 length bytes + topic prefix + pid
+        pkt = self._tx_pkt(5 + sz if copy_msg else 9 + len(topic))
+        pkt[0] = 0x30 | qos << 1 | retain | int(dup) << 3
         plen = self._varlen_encode(sz, pkt, 1)
-        self._write(pkt, plen)
-        self._send_str(topic)
+        plen = self._pack_str(pkt, plen, topic)
         if qos > 0:
-            pid = next(self.newpid)
-            self._write(pid.to_bytes(2, 'big'))
-        self._write(msg)
+            pid = self._next_pid()
+            struct.pack_into('>H', pkt, plen, pid)
+            plen += 2
+        if copy_msg:
+            pkt[plen:plen + len(msg)] = msg
+            plen += len(msg)
+            self._write(pkt, plen)
+        else:
+            self._write(pkt, plen)
+            self._write(msg)
         if qos > 0:
-            self.rcv_pids[pid] = ticks_add(ticks_ms(), self.message_timeout * 1000)
+            self.rcv_pids.append(pid)
+            self.rcv_deadlines.append(ticks_add(ticks_ms(), self.message_timeout * 1000))
             return pid
 
+    def publish_many(self, messages, retain=False, qos=0, dup=False):
+        """
+        Publishes several messages with a single socket write.
+
+        All PUBLISH packets are framed back to back in the shared transmit
+        buffer and sent at once, so a burst of small messages costs one
+        write/TCP segment instead of one per message. The whole batch is held
+        in RAM, so keep batches reasonably sized on small boards.
+
+        :param messages: Iterable of (topic, msg) pairs. Takes the same topic
+                         and message forms as publish().
+        :type messages: iterable
+        :param retain: Have the MQTT broker retain the messages.
+        :type retain: bool
+        :param qos: Sets quality of service level. Accepts values 0 to 1.
+        :type qos: int
+        :param dup: Duplicate delivery of a PUBLISH Control Packet
+        :type dup: bool
+        :return: List of pids if qos=1, else None
+        """
+        assert qos in (0, 1)
+        flags = 0x30 | qos << 1 | retain | int(dup) << 3
+        pids = [] if qos > 0 else None
+        buf = self._tx_buf
+        plen = 0
+        for topic, msg in messages:
+            sz = 2 + len(topic) + len(msg)
+            if qos > 0:
+                sz += 2
+            if len(buf) < plen + 5 + sz:
+                # Grow while keeping the packets already framed.
+                newbuf = bytearray(plen + 5 + sz)
+                newbuf[:plen] = buf[:plen]
+                buf = self._tx_buf = newbuf
+            buf[plen] = flags
+            plen = self._varlen_encode(sz, buf, plen + 1)
+            plen = self._pack_str(buf, plen, topic)
+            if qos > 0:
+                pid = self._next_pid()
+                struct.pack_into('>H', buf, plen, pid)
+                plen += 2
+                pids.append(pid)
+            buf[plen:plen + len(msg)] = msg
+            plen += len(msg)
+        if plen:
+            self._write(buf, plen)
+        if pids:
+            deadline = ticks_add(ticks_ms(), self.message_timeout * 1000)
+            for pid in pids:
+                self.rcv_pids.append(pid)
+                self.rcv_deadlines.append(deadline)
+        return pids
+
     def subscribe(self, topic, qos=0):
         """
         Subscribes to a given topic.
@@ -364,23 +529,51 @@ class MQTTClient:
         """
         assert qos in (0, 1)
         assert self.cb is not None, "Subscribe callback is not set"
-        pkt = bytearray(b"\x82\0\0\0\0\0\0")
-        pid = next(self.newpid)
+        pid = self._next_pid()
         sz = 2 + 2 + len(topic) + 1
+        # Whole SUBSCRIBE packet in one buffer, so one socket write sends one TCP segment.
+        pkt = self._tx_pkt(5 + sz)
+        pkt[0] = 0x82
         plen = self._varlen_encode(sz, pkt, 1)
-        pkt[plen:plen + 2] = pid.to_bytes(2, 'big')
-        self._write(pkt, plen + 2)
-        self._send_str(topic)
-        self._write(qos.to_bytes(1, "little"))  # maximum QOS value that can be given by the server to the client
-        self.rcv_pids[pid] = ticks_add(ticks_ms(), self.message_timeout * 1000)
+        struct.pack_into('>H', pkt, plen, pid)
+        plen += 2
+        plen = self._pack_str(pkt, plen, topic)
+        pkt[plen] = qos  # maximum QOS value that can be given by the server to the client
+        plen += 1
+        self._write(pkt, plen)
+        self.rcv_pids.append(pid)
+        self.rcv_deadlines.append(ticks_add(ticks_ms(), self.message_timeout * 1000))
         return pid
 
+    def _ack_pid(self, pid):
+        """
+        Private class method.
+        Removes a pid from the pending-ack list.
+
+        :param pid: pid confirmed by the server
+        :type pid: int
+        :return: True if the pid was pending
+        :rtype: bool
+        """
+        try:
+            i = self.rcv_pids.index(pid)
+        except ValueError:
+            return False
+        self.rcv_pids.pop(i)
+        self.rcv_deadlines.pop(i)
+        return True
+
     def _message_timeout(self):
+        rcv = self.rcv_pids
+        if not rcv:
+            return
+        deadlines = self.rcv_deadlines
         curr_tick = ticks_ms()
-        for pid, timeout in self.rcv_pids.items():
-            if ticks_diff(timeout, curr_tick) <= 0:
-                self.rcv_pids.pop(pid)
-                self.cbstat(pid, 0)
+        # The lists are ordered by deadline, so the sweep stops at the first
+        # entry that is still alive instead of scanning everything.
+        while rcv and ticks_diff(deadlines[0], curr_tick) <= 0:
+            deadlines.pop(0)
+            self.cbstat(rcv.pop(0), 0)
 
     def check_msg(self):
         """
@@ -388,7 +581,7 @@ class MQTTClient:
 
         If socket_timeout=None, this is the socket lock mode. That is, it waits until the data can be read.
 
-        Otherwise it will return None, after the time set in the socket_timeout.
+        Otherwise it returns None immediately when no data is pending.
 
         It processes such messages:
         - response to PING
@@ -398,17 +591,22 @@ class MQTTClient:
         :return: None
         """
         if self.sock:
-            if not self.poller_r.poll(-1 if self.socket_timeout is None else 1):
-                self._message_timeout()
+            # Non-blocking fast path: a zero-timeout poll returns at once when
+            # nothing is pending, instead of sleeping for the 1 ms minimum.
+            if not self.poller_r.poll(-1 if self.socket_timeout is None else 0):
+                if self.rcv_pids:  # skip the call when nothing awaits an ack
+                    self._message_timeout()
                 return None
             try:
                 res = self._read(1)  # Throws OSError on WiFi fail
                 if not res:
-                    self._message_timeout()
+                    if self.rcv_pids:
+                        self._message_timeout()
                     return None
             except OSError as e:
                 if e.args[0] == 110:  # Occurs when no incomming data
-                    self._message_timeout()
+                    if self.rcv_pids:
+                        self._message_timeout()
                     return None
                 else:
                     raise e
@@ -427,10 +625,9 @@ class MQTTClient:
             sz = self._read(1)
             if sz != b"\x02":
                 raise MQTTException(-1)
-            rcv_pid = int.from_bytes(self._read(2), 'big')
-            if rcv_pid in self.rcv_pids:
+            rcv_pid = struct.unpack('>H', self._read(2))[0]
+            if self._ack_pid(rcv_pid):
                 self.last_cpacket = ticks_ms()
-                self.rcv_pids.pop(rcv_pid)
                 self.cbstat(rcv_pid, 1)
             else:
                 self.cbstat(rcv_pid, 2)
@@ -448,32 +645,38 @@ class MQTTClient:
             if resp[3] not in (0, 1, 2):
                 raise MQTTException(40, resp)
             pid = resp[2] | (resp[1] << 8)
-            if pid in self.rcv_pids:
+            if self._ack_pid(pid):
                 self.last_cpacket = ticks_ms()
-                self.rcv_pids.pop(pid)
                 self.cbstat(pid, 1)
             else:
                 raise MQTTException(5)
 
-        self._message_timeout()
+        if self.rcv_pids:
+            self._message_timeout()
 
         if op & 0xf0 != 0x30:  # 3.3 PUBLISH – Publish message
             return op
         sz = self._recv_len()
-        topic_len = int.from_bytes(self._read(2), 'big')
-        topic = self._read(topic_len)
-        sz -= topic_len + 2
+        # One read for the whole variable header + payload instead of one per field.
+        data = self._read(sz)
+        topic_len = struct.unpack_from('>H', data)[0]
+        off = 2 + topic_len
+        topic = data[2:off]
         if op & 6:  # QoS level > 0
-            pid = int.from_bytes(self._read(2), 'big')
-            sz -= 2
-        msg = self._read(sz) if sz else b''
+            pid = struct.unpack_from('>H', data, off)[0]
+            off += 2
+        msg = data[off:]
         retained = op & 0x01
         dup = op & 0x08
         self.cb(topic, msg, bool(retained), bool(dup))
         self.last_cpacket = ticks_ms()
         if op & 6 == 2:  # QoS==1
-            self._write(b"\x40\x02")  # Send PUBACK
-            self._write(pid.to_bytes(2, 'big'))
+            # Send PUBACK with a single write
+            pkt = self._tx_pkt(4)
+            pkt[0] = 0x40
+            pkt[1] = 0x02
+            struct.pack_into('>H', pkt, 2, pid)
+            self._write(pkt, 4)
         elif op & 6 == 4:  # QoS==2
             raise NotImplementedError()
         elif op & 6 == 6:  # 3.3.1.2 QoS - Reserved – must not be used
@@ -1,26 +1,31 @@
 import usocket as socket
 import uselect
+import ustruct as struct
 from utime import ticks_add,ticks_ms,ticks_diff
 class MQTTException(Exception):0
-def pid_gen(pid=0):
-	A=pid
-	while True:A=A+1 if A<65535 else 1;yield A
 class MQTTClient:
+	__slots__='client_id','sock','poller_r','poller_w','server','port','ssl','ssl_params','_pid','cb','cbstat','user','pswd','keepalive','lw_topic','lw_msg','lw_qos','lw_retain','rcv_pids','rcv_deadlines','_tx_buf','_rx_buf','_connect_pkt','_connect_clean','last_ping','last_cpacket','socket_timeout','message_timeout';TX_BUF_SIZE=256;RX_BUF_SIZE=256
 	def __init__(A,client_id,server,port=0,user=None,password=None,keepalive=0,ssl=False,ssl_params=None,socket_timeout=5,message_timeout=10):
 		C=ssl_params;B=port
 		if B==0:B=8883 if ssl else 1883
-		A.client_id=client_id;A.sock=None;A.poller_r=None;A.poller_w=None;A.server=server;A.port=B;A.ssl=ssl;A.ssl_params=C if C else{};A.newpid=pid_gen()
+		A.client_id=client_id;A.sock=None;A.poller_r=None;A.poller_w=None;A.server=server;A.port=B;A.ssl=ssl;A.ssl_params=C if C else{};A._pid=0
 		if not getattr(A,'cb',None):A.cb=None
 		if not getattr(A,'cbstat',None):A.cbstat=lambda p,s:None
-		A.user=user;A.pswd=password;A.keepalive=keepalive;A.lw_topic=None;A.lw_msg=None;A.lw_qos=0;A.lw_retain=False;A.rcv_pids={};A.last_ping=ticks_ms();A.last_cpacket=ticks_ms();A.socket_timeout=socket_timeout;A.message_timeout=message_timeout
+		A.user=user;A.pswd=password;A.keepalive=keepalive;A.lw_topic=None;A.lw_msg=None;A.lw_qos=0;A.lw_retain=False;A.rcv_pids=[];A.rcv_deadlines=[];A._tx_buf=bytearray(A.TX_BUF_SIZE);A._rx_buf=bytearray(A.RX_BUF_SIZE);A._connect_pkt=None;A._connect_clean=None;A.last_ping=ticks_ms();A.last_cpacket=ticks_ms();A.socket_timeout=socket_timeout;A.message_timeout=message_timeout
 	def _read(A,n):
+		if not A.sock:raise MQTTException(28)
+		C=A._rx_buf
+		if len(C)<n:C=A._rx_buf=bytearray(n)
+		D=memoryview(C)
 		try:
-			B=b''
-			for C in range(n):A._sock_timeout(A.poller_r,A.socket_timeout);B+=A.sock.read(1)
+			F=A.poller_r.poll;G=A.sock.readinto;H=-1 if A.socket_timeout is None else int(A.socket_timeout*1000);B=0
+			while B<n:
+				if not F(H):raise MQTTException(30)
+				E=G(D[B:n])
+				if not E:raise MQTTException(1 if B==0 else 2)
+				B+=E
 		except AttributeError:raise MQTTException(8)
-		if B==b'':raise MQTTException(1)
-		if len(B)!=n:raise MQTTException(2)
-		return B
+		return bytes(D[:n])
 	def _write(A,bytes_wr,length=-1):
 		D=bytes_wr;B=length
 		try:A._sock_timeout(A.poller_w,A.socket_timeout);C=A.sock.write(D,B)
@@ -29,17 +34,27 @@ class MQTTClient:
 			if C!=len(D):raise MQTTException(3)
 		elif C!=B:raise MQTTException(3)
 		return C
-	def _send_str(A,s):assert len(s)<65536;A._write(len(s).to_bytes(2,'big'));A._write(s)
+	def _pack_str(B,buf,offset,s):
+		A=offset
+		if len(s)>65535:raise MQTTException(4)
+		struct.pack_into('>H',buf,A,len(s));A+=2;buf[A:A+len(s)]=s;return A+len(s)
+	def _tx_pkt(B,size):
+		A=B._tx_buf
+		if len(A)<size:A=B._tx_buf=bytearray(size)
+		return A
+	def _next_pid(A):B=A._pid+1 if A._pid<65535 else 1;A._pid=B;return B
 	def _recv_len(D):
 		A=0;B=0
 		while 1:
 			C=D._read(1)[0];A|=(C&127)<<B
 			if not C&128:return A
 			B+=7
-	def _varlen_encode(C,value,buf,offset=0):
-		B=offset;A=value;assert A<268435456
-		while A>127:buf[B]=A&127|128;A>>=7;B+=1
-		buf[B]=A;return B+1
+	def _varlen_encode(D,value,buf,offset=0):
+		C=buf;B=offset;A=value
+		if A<128:C[B]=A;return B+1
+		if A<16384:C[B]=A&127|128;C[B+1]=A>>7;return B+2
+		if A<2097152:C[B]=A&127|128;C[B+1]=A>>7&127|128;C[B+2]=A>>14;return B+3
+		assert A<268435456;C[B]=A&127|128;C[B+1]=A>>7&127|128;C[B+2]=A>>14&127|128;C[B+3]=A>>21;return B+4
 	def _sock_timeout(B,poller,socket_timeout):
 		A=socket_timeout
 		if B.sock:
@@ -48,76 +63,108 @@ class MQTTClient:
 		else:raise MQTTException(28)
 	def set_callback(A,f):A.cb=f
 	def set_callback_status(A,f):A.cbstat=f
-	def set_last_will(A,topic,msg,retain=False,qos=0):B=topic;assert 0<=qos<=2;assert B;A.lw_topic=B;A.lw_msg=msg;A.lw_qos=qos;A.lw_retain=retain
+	def set_last_will(A,topic,msg,retain=False,qos=0):B=topic;assert 0<=qos<=2;assert B;A.lw_topic=B;A.lw_msg=msg;A.lw_qos=qos;A.lw_retain=retain;A._connect_pkt=None
 	def connect(A,clean_session=True):
-		E=clean_session;A.sock=socket.socket();G=socket.getaddrinfo(A.server,A.port)[0][-1];A.sock.connect(G)
+		F=clean_session;F=bool(F)
+		if F:A.rcv_pids=[];A.rcv_deadlines=[]
+		A.sock=socket.socket();H=socket.getaddrinfo(A.server,A.port)[0][-1];A.sock.connect(H)
+		try:A.sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+		except(OSError,AttributeError):pass
 		if A.ssl:import ussl;A.sock=ussl.wrap_socket(A.sock,**A.ssl_params)
-		A.poller_r=uselect.poll();A.poller_r.register(A.sock,uselect.POLLIN);A.poller_w=uselect.poll();A.poller_w.register(A.sock,uselect.POLLOUT);F=bytearray(b'\x10\x00\x00\x00\x00\x00');B=bytearray(b'\x00\x04MQTT\x04\x00\x00\x00');D=10+2+len(A.client_id);B[7]=bool(E)<<1
-		if bool(E):A.rcv_pids.clear()
-		if A.user is not None:
-			D+=2+len(A.user);B[7]|=1<<7
-			if A.pswd is not None:D+=2+len(A.pswd);B[7]|=1<<6
-		if A.keepalive:assert A.keepalive<65536;B[8]|=A.keepalive>>8;B[9]|=A.keepalive&255
-		if A.lw_topic:D+=2+len(A.lw_topic)+2+len(A.lw_msg);B[7]|=4|(A.lw_qos&1)<<3|(A.lw_qos&2)<<3;B[7]|=A.lw_retain<<5
-		H=A._varlen_encode(D,F,1);A._write(F,H);A._write(B);A._send_str(A.client_id)
-		if A.lw_topic:A._send_str(A.lw_topic);A._send_str(A.lw_msg)
-		if A.user is not None:
-			A._send_str(A.user)
-			if A.pswd is not None:A._send_str(A.pswd)
-		C=A._read(4)
-		if not(C[0]==32 and C[1]==2):raise MQTTException(29)
-		if C[3]!=0:
-			if 1<=C[3]<=5:raise MQTTException(20+C[3])
-			else:raise MQTTException(20,C[3])
-		A.last_cpacket=ticks_ms();return C[2]&1
+		A.poller_r=uselect.poll();A.poller_r.register(A.sock,uselect.POLLIN);A.poller_w=uselect.poll();A.poller_w.register(A.sock,uselect.POLLOUT)
+		if A._connect_pkt is None or A._connect_clean!=F:
+			D=bytearray(b'\x00\x04MQTT\x04\x00\x00\x00');G=12+len(A.client_id);D[7]=F<<1
+			if A.user is not None:
+				G+=2+len(A.user);D[7]|=128
+				if A.pswd is not None:G+=2+len(A.pswd);D[7]|=64
+			if A.keepalive:assert A.keepalive<65536;D[8]=A.keepalive>>8;D[9]=A.keepalive&255
+			if A.lw_topic:G+=2+len(A.lw_topic)+2+len(A.lw_msg);D[7]|=4|A.lw_qos<<3|A.lw_retain<<5
+			C=A._tx_pkt(5+G);C[0]=16;B=A._varlen_encode(G,C,1);C[B:B+10]=D;B+=10;B=A._pack_str(C,B,A.client_id)
+			if A.lw_topic:B=A._pack_str(C,B,A.lw_topic);B=A._pack_str(C,B,A.lw_msg)
+			if A.user is not None:
+				B=A._pack_str(C,B,A.user)
+				if A.pswd is not None:B=A._pack_str(C,B,A.pswd)
+			A._connect_pkt=bytes(C[:B]);A._connect_clean=F
+		A._write(A._connect_pkt);E=A._read(4)
+		if not(E[0]==32 and E[1]==2):raise MQTTException(29)
+		if E[3]!=0:
+			if 1<=E[3]<=5:raise MQTTException(20+E[3])
+			else:raise MQTTException(20,E[3])
+		A.last_cpacket=ticks_ms();return E[2]&1
 	def disconnect(A):A._write(b'\xe0\x00');A.poller_r.unregister(A.sock);A.poller_w.unregister(A.sock);A.poller_r=None;A.poller_w=None;A.sock.close();A.sock=None
 	def ping(A):A._write(b'\xc0\x00');A.last_ping=ticks_ms()
 	def publish(A,topic,msg,retain=False,qos=0,dup=False):
-		E=topic;B=qos;assert B in(0,1);C=bytearray(b'0\x00\x00\x00\x00');C[0]|=B<<1|retain|int(dup)<<3;F=2+len(E)+len(msg)
-		if B>0:F+=2
-		G=A._varlen_encode(F,C,1);A._write(C,G);A._send_str(E)
-		if B>0:D=next(A.newpid);A._write(D.to_bytes(2,'big'))
-		A._write(msg)
-		if B>0:A.rcv_pids[D]=ticks_add(ticks_ms(),A.message_timeout*1000);return D
-	def subscribe(A,topic,qos=0):E=topic;assert qos in(0,1);assert A.cb is not None,'Subscribe callback is not set';B=bytearray(b'\x82\x00\x00\x00\x00\x00\x00');C=next(A.newpid);F=2+2+len(E)+1;D=A._varlen_encode(F,B,1);B[D:D+2]=C.to_bytes(2,'big');A._write(B,D+2);A._send_str(E);A._write(qos.to_bytes(1,'little'));A.rcv_pids[C]=ticks_add(ticks_ms(),A.message_timeout*1000);return C
+		G=topic;E=qos;D=msg;assert E in(0,1);F=2+len(G)+len(D)
+		if E>0:F+=2
+		I=5+F<=len(A._tx_buf);C=A._tx_pkt(5+F if I else 9+len(G));C[0]=48|E<<1|retain|int(dup)<<3;B=A._varlen_encode(F,C,1);B=A._pack_str(C,B,G)
+		if E>0:H=A._next_pid();struct.pack_into('>H',C,B,H);B+=2
+		if I:C[B:B+len(D)]=D;B+=len(D);A._write(C,B)
+		else:A._write(C,B);A._write(D)
+		if E>0:A.rcv_pids.append(H);A.rcv_deadlines.append(ticks_add(ticks_ms(),A.message_timeout*1000));return H
+	def publish_many(B,messages,retain=False,qos=0,dup=False):
+		D=qos;assert D in(0,1);K=48|D<<1|retain|int(dup)<<3;E=[]if D>0 else None;C=B._tx_buf;A=0
+		for(I,F)in messages:
+			G=2+len(I)+len(F)
+			if D>0:G+=2
+			if len(C)<A+5+G:J=bytearray(A+5+G);J[:A]=C[:A];C=B._tx_buf=J
+			C[A]=K;A=B._varlen_encode(G,C,A+1);A=B._pack_str(C,A,I)
+			if D>0:H=B._next_pid();struct.pack_into('>H',C,A,H);A+=2;E.append(H)
+			C[A:A+len(F)]=F;A+=len(F)
+		if A:B._write(C,A)
+		if E:
+			L=ticks_add(ticks_ms(),B.message_timeout*1000)
+			for H in E:B.rcv_pids.append(H);B.rcv_deadlines.append(L)
+		return E
+	def subscribe(A,topic,qos=0):E=topic;assert qos in(0,1);assert A.cb is not None,'Subscribe callback is not set';D=A._next_pid();F=4+len(E)+1;C=A._tx_pkt(5+F);C[0]=130;B=A._varlen_encode(F,C,1);struct.pack_into('>H',C,B,D);B+=2;B=A._pack_str(C,B,E);C[B]=qos;B+=1;A._write(C,B);A.rcv_pids.append(D);A.rcv_deadlines.append(ticks_add(ticks_ms(),A.message_timeout*1000));return D
+	def _ack_pid(A,pid):
+		try:B=A.rcv_pids.index(pid)
+		except ValueError:return False
+		A.rcv_pids.pop(B);A.rcv_deadlines.pop(B);return True
 	def _message_timeout(A):
-		C=ticks_ms()
-		for (B,D) in A.rcv_pids.items():
-			if ticks_diff(D,C)<=0:A.rcv_pids.pop(B);A.cbstat(B,0)
+		B=A.rcv_pids
+		if not B:return
+		C=A.rcv_deadlines;D=ticks_ms()
+		while B and ticks_diff(C[0],D)<=0:C.pop(0);A.cbstat(B.pop(0),0)
 	def check_msg(A):
 		if A.sock:
-			if not A.poller_r.poll(-1 if A.socket_timeout is None else 1):A._message_timeout();return None
+			if not A.poller_r.poll(-1 if A.socket_timeout is None else 0):
+				if A.rcv_pids:A._message_timeout()
+				return
 			try:
-				G=A._read(1)
-				if not G:A._message_timeout();return None
-			except OSError as H:
-				if H.args[0]==110:A._message_timeout();return None
-				else:raise H
+				H=A._read(1)
+				if not H:
+					if A.rcv_pids:A._message_timeout()
+					return
+			except OSError as K:
+				if K.args[0]==110:
+					if A.rcv_pids:A._message_timeout()
+					return
+				else:raise K
 		else:raise MQTTException(28)
-		if G==b'\xd0':
+		if H==b'\xd0':
 			if A._read(1)[0]!=0:MQTTException(-1)
 			A.last_cpacket=ticks_ms();return
-		B=G[0]
+		B=H[0]
 		if B==64:
-			D=A._read(1)
-			if D!=b'\x02':raise MQTTException(-1)
-			F=int.from_bytes(A._read(2),'big')
-			if F in A.rcv_pids:A.last_cpacket=ticks_ms();A.rcv_pids.pop(F);A.cbstat(F,1)
-			else:A.cbstat(F,2)
+			I=A._read(1)
+			if I!=b'\x02':raise MQTTException(-1)
+			J=struct.unpack('>H',A._read(2))[0]
+			if A._ack_pid(J):A.last_cpacket=ticks_ms();A.cbstat(J,1)
+			else:A.cbstat(J,2)
 		if B==144:
 			C=A._read(4)
 			if C[0]!=3:raise MQTTException(40,C)
 			if C[3]==128:raise MQTTException(44)
 			if C[3]not in(0,1,2):raise MQTTException(40,C)
-			E=C[2]|C[1]<<8
-			if E in A.rcv_pids:A.last_cpacket=ticks_ms();A.rcv_pids.pop(E);A.cbstat(E,1)
+			D=C[2]|C[1]<<8
+			if A._ack_pid(D):A.last_cpacket=ticks_ms();A.cbstat(D,1)
 			else:raise MQTTException(5)
-		A._message_timeout()
+		if A.rcv_pids:A._message_timeout()
 		if B&240!=48:return B
-		D=A._recv_len();I=int.from_bytes(A._read(2),'big');J=A._read(I);D-=I+2
-		if B&6:E=int.from_bytes(A._read(2),'big');D-=2
-		K=A._read(D)if D else b'';L=B&1;M=B&8;A.cb(J,K,bool(L),bool(M));A.last_cpacket=ticks_ms()
-		if B&6==2:A._write(b'@\x02');A._write(E.to_bytes(2,'big'))
-		elif B&6==4:raise NotImplementedError()
+		I=A._recv_len();E=A._read(I);L=struct.unpack_from('>H',E)[0];F=2+L;M=E[2:F]
+		if B&6:D=struct.unpack_from('>H',E,F)[0];F+=2
+		N=E[F:];O=B&1;P=B&8;A.cb(M,N,bool(O),bool(P));A.last_cpacket=ticks_ms()
+		if B&6==2:G=A._tx_pkt(4);G[0]=64;G[1]=2;struct.pack_into('>H',G,2,D);A._write(G,4)
+		elif B&6==4:raise NotImplementedError
 		elif B&6==6:raise MQTTException(-1)
 	def wait_msg(A):B=A.socket_timeout;A.socket_timeout=None;C=A.check_msg();A.socket_timeout=B;return C
\ No newline at end of file
@@ -1,6 +1,6 @@
 import utime
 from ubinascii import hexlify
-from umqtt.simple2 import MQTTClient as _MQTTClient, MQTTException, pid_gen
+from umqtt.simple2 import MQTTClient as _MQTTClient, MQTTException
 
 
 def debug_print(data):
@@ -24,7 +24,7 @@ class MQTTClient(_MQTTClient):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.newpid = pid_gen(65535 - 1)
+        self._pid = 65535 - 1
 
     def _read(self, n):
         out = super()._read(n)
@@ -151,6 +151,8 @@ class TestMQTT:
             'test_publish_qos_1',
             'test_publish_qos_1_no_puback',
             'test_publish_qos_2',
+            'test_publish_many_qos_0',
+            'test_publish_many_qos_1',
             'test_publish_retain',
             'test_publish_lastwill',
         ]
@@ -200,8 +202,9 @@ class TestMQTT:
     def test_publish_qos_1_no_puback(self, topic):
         self.client.connect()
         pid = self.client.publish(topic, 'test QoS 1', qos=1)
-        pid = next(self.client.newpid)
-        self.client.rcv_pids[pid] = utime.ticks_add(utime.ticks_ms(), self.client.message_timeout * 1000)
+        pid = self.client._next_pid()
+        self.client.rcv_pids.append(pid)
+        self.client.rcv_deadlines.append(utime.ticks_add(utime.ticks_ms(), self.client.message_timeout * 1000))
         out_pid, status = self.get_status_out(10, pid=pid)
         assert status == 0
         self.client.disconnect()
@@ -214,6 +217,38 @@ class TestMQTT:
             print(e)
         self.client.disconnect()
 
+    def test_publish_many_qos_0(self, topic):
+        self.client.connect()
+        pid = self.client.subscribe(topic + '#')
+        out_pid, status = self.get_status_out(pid=pid)
+        assert status == 1
+        msgs_in = ['batch 0', 'batch 1', 'batch 2']
+        pids = self.client.publish_many([(topic, m) for m in msgs_in])
+        assert pids is None
+        for msg_in in msgs_in:
+            msg_out = self.get_subscription_out()[1]
+            assert msg_in == msg_out.decode('ascii')
+        self.client.disconnect()
+
+    def test_publish_many_qos_1(self, topic):
+        self.client.connect()
+        client_2 = self.init_mqtt_client('_2')
+        client_2.connect()
+        pid = client_2.subscribe(topic + '#')
+        out_pid, status = self.get_status_out(pid=pid, clientid_postfix='_2')
+        assert status == 1
+        msgs_in = ['batch 0', 'batch 1', 'batch 2']
+        pids = self.client.publish_many([(topic, m) for m in msgs_in], qos=1)
+        assert len(pids) == len(msgs_in)
+        for pub_pid in pids:
+            out_pid, status = self.get_status_out(pid=pub_pid)
+            assert status == 1
+        for msg_in in msgs_in:
+            msg_out = self.get_subscription_out(clientid_postfix='_2')[1]
+            assert msg_in == msg_out.decode('ascii')
+        self.client.disconnect()
+        client_2.disconnect()
+
     def test_publish_retain(self, topic):
         self.client.connect()
         pid = self.client.publish(topic, 'test retain', qos=1, retain=True)